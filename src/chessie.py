@@ -33,6 +33,15 @@ PLAYER = 0 # 0 = White, 1 = Black
 
 themes = ["gray","brown"]
 
+def to_view(row,col):
+    """
+    Map a board tile to the tile drawn on screen (and back, the flip is its own inverse).
+    The engine always stores the board from white's view, black's view turns it around.
+    """
+    if PLAYER == 0:
+        return row, col
+    return BOARD_SIZE-1 - row, BOARD_SIZE-1 - col
+
 def load_sprites():
     """
     Load all pieces sprites.
@@ -70,7 +79,7 @@ def render_board(screen,theme=0):
     else:
         color = 'brown'
 
-    # Note: Tile (0,0) for both perspective is a light tile.
+    # Note: Tile (0,0) for both perspective is a light tile (turning the board around keeps every tile's shade).
     # Because the tiles are interleaved, we can use the tile's coordinates to find its color.
     shades = ['light','dark']
     for row in range(BOARD_SIZE):
@@ -90,24 +99,27 @@ def render_tiles(screen,board):
 
             if piece != "---":
                 piece_name = piece.name
-                screen.blit(SPRITES[piece_name], pg.Rect(col*TILE_SIZE, row*TILE_SIZE, TILE_SIZE, TILE_SIZE))
+                view_row, view_col = to_view(row,col)
+                screen.blit(SPRITES[piece_name], pg.Rect(view_col*TILE_SIZE, view_row*TILE_SIZE, TILE_SIZE, TILE_SIZE))
 
 
 def render_selection(screen,board,selection,valid_moves):
     row = selection[0]
     col = selection[1]
-    screen.blit(SPRITES['selected'], pg.Rect(col*TILE_SIZE, row*TILE_SIZE, TILE_SIZE, TILE_SIZE))
+    view_row, view_col = to_view(row,col)
+    screen.blit(SPRITES['selected'], pg.Rect(view_col*TILE_SIZE, view_row*TILE_SIZE, TILE_SIZE, TILE_SIZE))
 
     if board[row,col] != '---':
         for move in valid_moves:
             if move.src_row == row and move.src_col == col:
                 new_row = move.dst_row
                 new_col = move.dst_col
+                view_row, view_col = to_view(new_row,new_col)
 
                 if board[new_row,new_col] == '---':
-                    screen.blit(SPRITES['valid'], pg.Rect(new_col*TILE_SIZE, new_row*TILE_SIZE, TILE_SIZE, TILE_SIZE))
+                    screen.blit(SPRITES['valid'], pg.Rect(view_col*TILE_SIZE, view_row*TILE_SIZE, TILE_SIZE, TILE_SIZE))
                 else:
-                    screen.blit(SPRITES['capture'], pg.Rect(new_col*TILE_SIZE, new_row*TILE_SIZE, TILE_SIZE, TILE_SIZE))
+                    screen.blit(SPRITES['capture'], pg.Rect(view_col*TILE_SIZE, view_row*TILE_SIZE, TILE_SIZE, TILE_SIZE))
 
 def draw_board(screen,state,selection=(),valid_moves=[]):
     """
@@ -143,8 +155,7 @@ def main():
             elif e.type == pg.MOUSEBUTTONDOWN:
                 pos = pg.mouse.get_pos() # Add offset if extra GUI panels are added (mouse coord needs to be relative to the board's borders, not window's)
 
-                col = pos[0] // TILE_SIZE
-                row = pos[1] // TILE_SIZE
+                row, col = to_view(pos[1] // TILE_SIZE, pos[0] // TILE_SIZE) # Selections are kept in board coordinates
 
                 if (row,col) == selected: # Selected the same tile twice, deselect
                     selected = ()
@@ -0,0 +1,288 @@
+"""
+BATCH MOVE GENERATION FOR MANY CHESSIE POSITIONS AT ONCE.
+
+Positions are stacked into NumPy arrays so every rule is applied to the whole batch in one operation:
+    boards: (N,64) int8, tiles in row-major order of State.board (tile = row*8 + col),
+            0 = empty, 1-6 = white pawn/knight/bishop/rook/queen/king, negative for black.
+    players: (N,) int8, player to move (0 = white, 1 = black).
+    enpassant: (N,) int8, en passant tile or -1.
+
+Legal moves come back as a (K,3) int16 array of (position,src,dst) rows, one per move. Promotions are always to a
+queen, so (src,dst) is enough to identify a move, as in Move.
+"""
+import numpy as np
+
+from chessie_engine import *
+
+knight_steps = knight_moves
+king_steps = directions
+
+
+def get_targets(steps):
+    """
+    For each step (row,col) and tile, the tile reached by one step, or -1 when it falls off the board.
+    """
+    targets = np.full((len(steps),64), -1, dtype=np.int64)
+    for j in range(len(steps)):
+        for tile in range(64):
+            row = tile // 8 + steps[j][0]
+            col = tile % 8 + steps[j][1]
+            if 0 <= row < 8 and 0 <= col < 8:
+                targets[j,tile] = row*8 + col
+    return targets
+
+directions_targets = get_targets(directions)
+knight_targets = get_targets(knight_steps)
+king_targets = get_targets(king_steps)
+
+# Tiles reached by a white pawn's captures (up-left, up-right), the side to move is always white once oriented
+pawn_captures_targets = get_targets([(-1,-1),(-1,1)])
+
+
+def state_to_arrays(state):
+    """
+    Encode a State as (board,player,enpassant) rows of a batch.
+    """
+    return unpack_position(state.to_bytes())
+
+
+def states_to_batch(states):
+    """
+    Stack many States into the (boards,players,enpassant) arrays taken by get_valid_moves_batch.
+    """
+    rows = [state_to_arrays(state) for state in states]
+    boards = np.array([row[0] for row in rows], dtype=np.int8).reshape(len(rows),64)
+    players = np.array([row[1] for row in rows], dtype=np.int8)
+    enpassant = np.array([row[2] for row in rows], dtype=np.int8)
+    return boards, players, enpassant
+
+
+mirror_tiles = np.arange(64) ^ 56 # Tile reached by swapping the rows
+
+
+def pack_position(board,player,enpassant):
+    """
+    Pack one row of a batch into RECORD_SIZE bytes (chessie_engine).
+    """
+    return board.astype(np.int8).tobytes() + bytes([int(player), int(enpassant) & 0xff])
+
+
+def unpack_position(record):
+    """
+    Read a packed position (or the start of a State snapshot) back, the board is a read-only view of the record.
+    """
+    board = np.frombuffer(record, dtype=np.int8, count=64)
+    enpassant = record[65] if record[65] < 128 else record[65] - 256
+    return board, record[64], enpassant
+
+
+def orient(boards,players,enpassant):
+    """
+    Mirror black-to-move positions so the player to move is always white moving up the board.
+    Mirroring swaps rows (tile ^ 56) and colors, and is its own inverse.
+    """
+    black = players == 1
+    mirrored = -boards.reshape(-1,8,8)[:,::-1,:].reshape(-1,64)
+    boards = np.where(black[:,None], mirrored, boards).astype(np.int8)
+    enpassant = np.where(black & (enpassant >= 0), enpassant ^ 56, enpassant)
+    return boards, enpassant
+
+
+def is_attacked(boards,tiles):
+    """
+    For each board, whether the tile is attacked by black (negative) pieces.
+    Slides out from the tile in every direction and looks at the first piece met, like State.get_pins_and_checks.
+    """
+    n = len(boards)
+    index = np.arange(n)
+    attacked = np.zeros(n, dtype=bool)
+
+    for j in range(len(directions)):
+        sliders = (-ROOK, -QUEEN) if j <= 3 else (-BISHOP, -QUEEN)
+        current = tiles.copy()
+        open_ray = np.ones(n, dtype=bool)
+        for i in range(1,8):
+            current = np.where(open_ray, directions_targets[j][current], -1)
+            open_ray &= current >= 0
+            piece = np.where(open_ray, boards[index,np.maximum(current,0)], 0)
+
+            hit = open_ray & ((piece == sliders[0]) | (piece == sliders[1]))
+            if i == 1:
+                hit |= open_ray & (piece == -KING)
+                if j >= 4 and directions[j][0] == -1: # Black pawns attack downwards
+                    hit |= open_ray & (piece == -PAWN)
+            attacked |= hit
+            open_ray &= piece == 0
+
+    for j in range(len(knight_steps)):
+        target = knight_targets[j][tiles]
+        attacked |= (target >= 0) & (boards[index,np.maximum(target,0)] == -KNIGHT)
+    return attacked
+
+
+def get_pinned(boards,kings):
+    """
+    For each board, a (N,64) mask of the white pieces pinned to the white king on its tile.
+    Slides out from the king in every direction: a pin is one white piece, then a black slider moving that way.
+    """
+    n = len(boards)
+    index = np.arange(n)
+    pinned = np.zeros((n,64), dtype=bool)
+
+    for j in range(len(directions)):
+        sliders = (-ROOK, -QUEEN) if j <= 3 else (-BISHOP, -QUEEN)
+        current = kings.copy()
+        shield = np.full(n, -1) # First white piece met on the ray
+        open_ray = np.ones(n, dtype=bool)
+        for i in range(1,8):
+            current = np.where(open_ray, directions_targets[j][current], -1)
+            open_ray &= current >= 0
+            piece = np.where(open_ray, boards[index,np.maximum(current,0)], 0)
+
+            pin = open_ray & (shield >= 0) & ((piece == sliders[0]) | (piece == sliders[1]))
+            pinned[index[pin],shield[pin]] = True
+            first = open_ray & (piece > 0) & (shield < 0)
+            shield = np.where(first, current, shield)
+            open_ray &= (piece == 0) | first
+    return pinned
+
+
+def get_pseudo_moves(boards,enpassant):
+    """
+    Moves of the white pieces ignoring checks, as (position,src,dst) arrays with one entry per move.
+    Only the white pieces are looked at, each through the precomputed target tables.
+    """
+    position, src = np.nonzero(boards > 0)
+    piece = boards[position,src]
+    found = []
+
+    def add_steps(targets,selected):
+        step_position = np.tile(position[selected], len(targets))
+        step_src = np.tile(src[selected], len(targets))
+        step_dst = targets[:,src[selected]].ravel()
+        valid = step_dst >= 0
+        valid[valid] = boards[step_position[valid],step_dst[valid]] <= 0
+        found.append((step_position[valid],step_src[valid],step_dst[valid]))
+
+    add_steps(knight_targets,piece == KNIGHT)
+    add_steps(king_targets,piece == KING)
+
+    for j in range(len(directions)):
+        sliders = (ROOK, QUEEN) if j <= 3 else (BISHOP, QUEEN)
+        selected = (piece == sliders[0]) | (piece == sliders[1])
+        ray_position, ray_src = position[selected], src[selected]
+        current = ray_src
+        for i in range(1,8):
+            current = directions_targets[j][current]
+            on_board = current >= 0
+            ray_position, ray_src, current = ray_position[on_board], ray_src[on_board], current[on_board]
+            if len(current) == 0:
+                break
+            target = boards[ray_position,current]
+            reached = target <= 0
+            found.append((ray_position[reached],ray_src[reached],current[reached]))
+            open_ray = target == 0 # Rays stop at the first piece
+            ray_position, ray_src, current = ray_position[open_ray], ray_src[open_ray], current[open_ray]
+
+    pawns = piece == PAWN
+    pawn_position, pawn_src = position[pawns], src[pawns]
+    single = pawn_src - 8
+    open_single = (single >= 0) & (boards[pawn_position,np.maximum(single,0)] == EMPTY)
+    found.append((pawn_position[open_single],pawn_src[open_single],single[open_single]))
+    double = pawn_src - 16
+    open_double = open_single & (pawn_src >= 48) & (boards[pawn_position,np.maximum(double,0)] == EMPTY)
+    found.append((pawn_position[open_double],pawn_src[open_double],double[open_double]))
+
+    for j in range(len(pawn_captures_targets)):
+        target = pawn_captures_targets[j][pawn_src]
+        capture = (target >= 0) & ((boards[pawn_position,np.maximum(target,0)] < 0) |
+                                   (target == enpassant[pawn_position]))
+        found.append((pawn_position[capture],pawn_src[capture],target[capture]))
+
+    return tuple(np.concatenate([moves[k] for moves in found]) for k in range(3))
+
+
+def get_valid_moves_batch(boards,players,enpassant):
+    """
+    Legal moves of the player to move for every position, as a (K,3) int16 array of (position,src,dst) rows
+    in position order. Matches State.get_valid_moves position by position.
+    """
+    boards = np.asarray(boards, dtype=np.int8).reshape(-1,64)
+    players = np.asarray(players, dtype=np.int8)
+    enpassant = np.asarray(enpassant, dtype=np.int8)
+
+    oriented, oriented_enpassant = orient(boards,players,enpassant)
+    position, src, dst = get_pseudo_moves(oriented,oriented_enpassant)
+
+    # Only king moves, moves out of check, moves of pinned pieces and en passant captures (two pawns leave the row)
+    # can leave the king attacked. Those are played and tested, the others are legal as generated.
+    kings = np.argmax(oriented == KING, axis=1)
+    checked = is_attacked(oriented,kings)
+    pinned = get_pinned(oriented,kings)
+    piece = oriented[position,src]
+    enpassant_capture = (piece == PAWN) & (dst == oriented_enpassant[position]) & (src % 8 != dst % 8)
+    replayed = np.nonzero((piece == KING) | checked[position] | pinned[position,src] | enpassant_capture)[0]
+
+    replayed_position, replayed_src, replayed_dst = position[replayed], src[replayed], dst[replayed]
+    replayed_piece = piece[replayed]
+    after = oriented[replayed_position]
+    candidates = np.arange(len(replayed))
+
+    taken = enpassant_capture[replayed]
+    after[candidates[taken],replayed_dst[taken] + 8] = EMPTY
+    after[candidates,replayed_dst] = np.where((replayed_piece == PAWN) & (replayed_dst < 8), QUEEN, replayed_piece)
+    after[candidates,replayed_src] = EMPTY
+
+    after_kings = np.where(replayed_piece == KING, replayed_dst, kings[replayed_position])
+    legal = np.ones(len(position), dtype=bool)
+    legal[replayed] = ~is_attacked(after,after_kings)
+    position, src, dst = position[legal], src[legal], dst[legal]
+
+    # Back to the real orientation for black-to-move positions
+    black = players[position] == 1
+    src = np.where(black, src ^ 56, src)
+    dst = np.where(black, dst ^ 56, dst)
+
+    order = np.lexsort((dst,src,position))
+    return np.stack((position[order],src[order],dst[order]), axis=1).astype(np.int16)
+
+
+def arrays_to_state(board,player,enpassant):
+    """
+    Build a State from one (board,player,enpassant) row of a batch. The State has no history.
+    """
+    snapshot = bytearray(SNAPSHOT.size)
+    SNAPSHOT.pack_into(snapshot,0,np.asarray(board,dtype=np.int8).tobytes(),int(player),int(enpassant),0,int(player),0)
+    state = State.from_bytes(snapshot) # Moves made so far only matter for whose turn it is
+    state.verbose = False
+    return state
+
+
+def snapshots_to_batch(buffer,count=None):
+    """
+    View State snapshots stored back to back in a buffer as the (boards,players,enpassant) arrays taken by
+    get_valid_moves_batch, without copying them.
+    """
+    snapshots = np.frombuffer(buffer, dtype=snapshot_dtype, count=-1 if count is None else count)
+    return snapshots["board"], snapshots["player"], snapshots["enpassant"]
+
+
+def play_move(board,player,enpassant,src,dst):
+    """
+    Play a (legal) move on one row of a batch, like State.move_piece. Returns the new (board,player,enpassant).
+    """
+    board = board.copy()
+    piece = board[src]
+
+    if abs(piece) == PAWN and dst == enpassant and src % 8 != dst % 8:
+        board[(src // 8)*8 + dst % 8] = EMPTY
+    if abs(piece) == PAWN and dst // 8 in (0,7):
+        piece = QUEEN if piece > 0 else -QUEEN
+    board[dst] = piece
+    board[src] = EMPTY
+
+    if abs(piece) == PAWN and abs(src - dst) == 16:
+        enpassant = (src + dst) // 2
+    else:
+        enpassant = -1
+    return board, 1 - player, enpassant
@@ -0,0 +1,68 @@
+"""
+PARITY CHECK OF THE BATCH MOVE GENERATOR (chessie_batch) AGAINST State.get_valid_moves.
+
+Usage: python chessie_batch_check.py
+"""
+import random
+
+from chessie_batch import *
+
+
+def check_batch(states):
+    """
+    Compare get_valid_moves_batch with State.get_valid_moves on every state.
+    Returns the (index,missing,extra) of each state where they disagree, as sets of (src,dst) tiles.
+    """
+    found = [set() for _ in states]
+    for position, src, dst in get_valid_moves_batch(*states_to_batch(states)).tolist():
+        found[position].add((src,dst))
+
+    mismatches = []
+    for i in range(len(states)):
+        expected = {(move.src_row*8 + move.src_col, move.dst_row*8 + move.dst_col)
+                    for move in states[i].get_valid_moves()}
+        if expected != found[i]:
+            mismatches.append((i,expected - found[i],found[i] - expected))
+    return mismatches
+
+
+def get_check_states(games=200,seed=0):
+    """
+    States to run check_batch on: positions with pinned pawns moving along the pin, then random game positions.
+    """
+    rng = random.Random(seed)
+
+    def from_tiles(pieces,player=0,enpassant=-1):
+        board = np.zeros(64, dtype=np.int8)
+        for notation, code in pieces.items():
+            board[Move.ranks_to_rows[notation[1]]*8 + Move.files_to_cols[notation[0]]] = code
+        return arrays_to_state(board,player,enpassant)
+
+    states = [
+        # Pawn pinned on its file, pushing toward its own king
+        from_tiles({"e6": KING, "e4": PAWN, "e1": -ROOK, "a8": -KING}),
+        from_tiles({"e3": -KING, "e5": -PAWN, "e8": ROOK, "a1": KING}, 1),
+        # Pawn pinned on a diagonal, taking en passant toward its own king
+        from_tiles({"c7": KING, "e5": PAWN, "g3": -BISHOP, "d5": -PAWN, "a1": -KING}, 0, 2*8 + 3),
+        from_tiles({"c2": -KING, "e4": -PAWN, "g6": BISHOP, "d4": PAWN, "a8": KING}, 1, 5*8 + 3),
+    ]
+
+    for game in range(games):
+        state = State()
+        state.verbose = False
+        for ply in range(rng.randint(0,120)):
+            moves = state.get_valid_moves()
+            if len(moves) == 0:
+                break
+            state.move_piece(rng.choice(moves))
+        states.append(state)
+    return states
+
+
+if __name__ == "__main__":
+    states = get_check_states()
+    mismatches = check_batch(states)
+    for i, missing, extra in mismatches:
+        print("Position {}: missing {}, extra {}".format(i,sorted(missing),sorted(extra)))
+        print(states[i].board)
+    print("{} positions checked, {} mismatches.".format(len(states),len(mismatches)))
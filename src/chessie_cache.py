@@ -0,0 +1,103 @@
+"""
+PERSISTENT ANALYSIS CACHE SHARED ACROSS SESSIONS AND PROCESSES.
+
+Search results (best move, score, depth, nodes) are stored in a SQLite file keyed by a 64-bit hash of the packed
+position (State.get_key, get_position_key). The database runs in WAL mode so any number of processes can read while
+one writes; each process opens its own AnalysisCache on the same path. Writes and LRU timestamps are buffered and
+written in batches, and the least recently used entries are evicted once the cache grows past max_entries.
+
+An AnalysisCache may be used from another thread than the one that opened it, but by one thread at a time.
+"""
+import sqlite3
+import time
+
+
+class AnalysisCache:
+    def __init__(self,path,max_entries=1000000,batch_size=256):
+        """
+        Entries are (src,dst,score,depth,nodes), tiles as row*8 + col, src is -1 when the position has no moves.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+
+        self.pending = {} # key -> entry waiting to be written
+        self.touched = {} # key -> last use, for entries read since the last flush
+
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS analysis (
+                                           key INTEGER PRIMARY KEY,
+                                           src INTEGER, dst INTEGER, score INTEGER, depth INTEGER, nodes INTEGER,
+                                           used REAL)""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS analysis_used ON analysis (used)")
+
+            # Number of entries kept up to date by triggers, so eviction doesn't need to count the whole table
+            self.connection.execute("CREATE TABLE IF NOT EXISTS analysis_size (entries INTEGER)")
+            self.connection.execute("""CREATE TRIGGER IF NOT EXISTS analysis_insert AFTER INSERT ON analysis
+                                       BEGIN UPDATE analysis_size SET entries = entries + 1; END""")
+            self.connection.execute("""CREATE TRIGGER IF NOT EXISTS analysis_delete AFTER DELETE ON analysis
+                                       BEGIN UPDATE analysis_size SET entries = entries - 1; END""")
+            self.connection.execute("""INSERT INTO analysis_size SELECT (SELECT COUNT(*) FROM analysis)
+                                       WHERE NOT EXISTS (SELECT * FROM analysis_size)""")
+
+    def get(self,key):
+        """
+        Return the cached entry of a position, or None.
+        """
+        if key in self.pending:
+            return self.pending[key]
+
+        row = self.connection.execute("SELECT src, dst, score, depth, nodes FROM analysis WHERE key = ?",
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+
+        self.touched[key] = time.time()
+        if len(self.touched) >= self.batch_size:
+            self.flush()
+        return row
+
+    def put(self,key,src,dst,score,depth,nodes):
+        """
+        Queue a search result. Entries from a shallower search than the one stored are dropped when written.
+        """
+        current = self.pending.get(key)
+        if current is None or depth >= current[3]:
+            self.pending[key] = (src,dst,score,depth,nodes)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write queued entries and timestamps, then evict least recently used entries past max_entries.
+        """
+        if len(self.pending) == 0 and len(self.touched) == 0:
+            return
+
+        now = time.time()
+        with self.connection:
+            self.connection.executemany("""INSERT INTO analysis (key, src, dst, score, depth, nodes, used)
+                                           VALUES (?, ?, ?, ?, ?, ?, ?)
+                                           ON CONFLICT (key) DO UPDATE SET
+                                               src = excluded.src, dst = excluded.dst, score = excluded.score,
+                                               depth = excluded.depth, nodes = excluded.nodes, used = excluded.used
+                                           WHERE excluded.depth >= analysis.depth""",
+                                        [(key,) + entry + (now,) for key, entry in self.pending.items()])
+            self.connection.executemany("UPDATE analysis SET used = ? WHERE key = ?",
+                                        [(used,key) for key, used in self.touched.items()])
+
+            if len(self.pending) > 0:
+                count = self.connection.execute("SELECT entries FROM analysis_size").fetchone()[0]
+                if count > self.max_entries:
+                    self.connection.execute("""DELETE FROM analysis WHERE key IN
+                                                   (SELECT key FROM analysis ORDER BY used LIMIT ?)""",
+                                            (count - self.max_entries,))
+        self.pending = {}
+        self.touched = {}
+
+    def close(self):
+        self.flush()
+        self.connection.close()
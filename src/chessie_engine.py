@@ -1,6 +1,9 @@
 """
 ENGINE TO PROCESS CHESSIE'S STATES AND GAME RULES.
 """
+import hashlib
+import struct
+
 import numpy as np
 
 pieces_full_names = {
@@ -24,6 +27,28 @@ pieces_types = ["b","k","n","p","q","r"]
 
 all_colors = ['w','b']
 
+pieces_values = {"p": 100, "n": 320, "b": 330, "r": 500, "q": 900, "k": 20000} # Material values in centipawns
+
+# Piece codes of packed boards: 0 = empty, positive for white, negative for black
+EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(7)
+
+pieces_codes = {"p": PAWN, "n": KNIGHT, "b": BISHOP, "r": ROOK, "q": QUEEN, "k": KING}
+
+# Directions scanned from a square: 0-3 are orthogonal (rooks/queens), 4-7 are diagonal (bishops/queens)
+directions = [(-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1)]
+
+knight_moves = [(-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)]
+
+def is_attacker(piece,j,i):
+    """
+    Return whether a piece found i tiles away in directions[j] from a square attacks that square.
+    """
+    type = piece.type
+    return (0 <= j <= 3 and type == 'r') \
+        or (4 <= j <= 7 and type == 'b') \
+        or (i == 1 and type == 'p' and ((piece.color == 'w' and 6 <= j <= 7) or (piece.color == 'b' and 4 <= j <= 5))) \
+        or (type == 'q') or (i == 1 and type == 'k')
+
 class Piece:
     def __init__(self,name):
         if name not in pieces_names:
@@ -66,35 +91,52 @@ class Piece:
         return self.name
 
 
+# Pieces never change once created, so packed boards are unpacked into these shared instances
+pieces_by_byte = {(pieces_codes[name[2]] if name[0] == 'w' else -pieces_codes[name[2]]) & 0xff: Piece(name)
+                  for name in pieces_names} # Code as an unsigned byte -> Piece
+pieces_by_byte[EMPTY] = "---"
+
+bytes_by_name = {str(piece): code for code, piece in pieces_by_byte.items()} # Piece name -> code as an unsigned byte
+
+# State snapshot: board codes, player to move, en passant tile (-1: none), castling rights (none in the engine yet,
+# always 0), moves made so far, position key (0: not stored). The first RECORD_SIZE bytes are a packed position.
+SNAPSHOT = struct.Struct("<64sBbBHq")
+
+# The same layout for NumPy, to view snapshots laid out back to back (e.g. in shared memory) as arrays
+snapshot_dtype = np.dtype([("board", np.int8, 64), ("player", np.uint8), ("enpassant", np.int8),
+                           ("castling", np.uint8), ("moves", "<u2"), ("key", "<i8")])
+assert snapshot_dtype.itemsize == SNAPSHOT.size, "snapshot_dtype doesn't match SNAPSHOT"
+
+RECORD_SIZE = 66 # Bytes of a packed position: 64 tiles + player + en passant, the start of a snapshot (chessie_batch)
+
+def get_position_key(record):
+    """
+    64-bit key of a packed position (the first RECORD_SIZE bytes of a snapshot).
+    """
+    return int.from_bytes(hashlib.blake2b(record[:RECORD_SIZE], digest_size=8).digest(), 'big', signed=True)
+
+
 class Move:
     """
     Chess (rank-file) notations:
     Ranks := Rows (1-8)
     Files := Colums (a-h)
+    Boards are always stored from white's view (rank 8 on row 0, file a on col 0), the GUI flips them for black.
     """
-    ranks_to_rows = [{"1": 7, "2": 6, "3": 5, "4": 4,
-                      "5": 3, "6": 2, "7": 1, "8": 0},
-                     {"1": 0, "2": 1, "3": 2, "4": 3,
-                      "5": 4, "6": 5, "7": 6, "8": 7}]
-
-    rows_to_ranks = [{x: y for y, x in ranks_to_rows[0].items()},
-                     {x: y for y, x in ranks_to_rows[1].items()}]
+    ranks_to_rows = {"1": 7, "2": 6, "3": 5, "4": 4,
+                     "5": 3, "6": 2, "7": 1, "8": 0}
 
-    files_to_cols = [{"a": 0, "b": 1, "c": 2, "d": 3,
-                      "e": 4, "f": 5, "g": 6, "h": 7},
-                     {"a": 7, "b": 6, "c": 5, "d": 4,
-                      "e": 3, "f": 2, "g": 1, "h": 0}]
+    rows_to_ranks = {x: y for y, x in ranks_to_rows.items()}
 
-    cols_to_files = [{x: y for y, x in files_to_cols[0].items()},
-                     {x: y for y, x in files_to_cols[1].items()}]
+    files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3,
+                     "e": 4, "f": 5, "g": 6, "h": 7}
 
+    cols_to_files = {x: y for y, x in files_to_cols.items()}
 
-
-    def __init__(self,src,dst,board,player=0):
+    def __init__(self,src,dst,board):
         """
         Using Move class to have convenient data storage with each move.
         """
-        self.player = player # 0: white, 1: player
         self.src_row = src[0]
         self.src_col = src[1]
         self.dst_row = dst[0]
@@ -129,36 +171,41 @@ class Move:
         """
         Return Rank-File notation of the tile.
         """
-        return self.cols_to_files[self.player][col] + self.rows_to_ranks[self.player][row]
+        return self.cols_to_files[col] + self.rows_to_ranks[row]
 
     def set_enpassant(self):
         self.enpassant = True
         self.capture = self.enpassant_capture
 
 class State:
-    def __init__(self,player_view=0,size=8):
+    def __init__(self,size=8):
         """
-        player_view: {0 = white's view; 1 = black's view}
+        The board is always stored from white's view, see Move.
         """
-        self.board = self.create_board(player_view)
+        self.board = self.create_board()
         self.size = size
-        self.player_view = player_view
         self.moving_player = 0 # White moves first
         self.moves = 0 # Number of moves made so far
         self.history = [] # Keep track of moves made so far
-        self.kings = [(7,4),(0,4)] # Keep track of kings' coordinates for mate checks [white,black] from white's view
+        self.history_shared = False # History list shared with a clone, copied before it changes
+        self.kings = [(7,4),(0,4)] # Keep track of kings' coordinates for mate checks [white,black]
 
         self.pins = []
         self.checks = []
         self.checked = [False,False]
         self.enpassant_square = ()
+        self.key = 0 # Position key read from a snapshot, 0 when not known (cleared by every move)
+
+        self.verbose = True # Print turn/move-generation messages (searches turn this off)
+        self.captures_only = False # Set by get_capture_moves while generating moves
 
     def get_moving_player(self):
         self.moving_player = self.moves % 2 # Even number: White's turn, odd number: Black's turn
-        if self.moving_player == 0:
-            print("White's turn to move.")
-        else:
-            print("Black's turn to move.")
+        if self.verbose:
+            if self.moving_player == 0:
+                print("White's turn to move.")
+            else:
+                print("Black's turn to move.")
         return self.moving_player
 
     def get_kings(self):
@@ -173,31 +220,110 @@ class State:
     def get_my_king(self):
         return self.kings[(self.moving_player)]
 
-    def create_board(self,player_view=0):
-        if player_view == 0:
-            board = np.array([
-            [Piece("b_r"),Piece("b_n"),Piece("b_b"),Piece("b_q"),Piece("b_k"),Piece("b_b"),Piece("b_n"),Piece("b_r")],
-            [Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p")],
-            ["---","---","---","---","---","---","---","---"],
-            ["---","---","---","---","---","---","---","---"],
-            ["---","---","---","---","---","---","---","---"],
-            ["---","---","---","---","---","---","---","---"],
-            [Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p")],
-            [Piece("w_r"),Piece("w_n"),Piece("w_b"),Piece("w_q"),Piece("w_k"),Piece("w_b"),Piece("w_n"),Piece("w_r")]
-            ])
-        else:
-            board = np.array([
-            [Piece("w_r"),Piece("w_n"),Piece("w_b"),Piece("w_q"),Piece("w_k"),Piece("w_b"),Piece("w_n"),Piece("w_r")],
-            [Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p")],
-            ["---","---","---","---","---","---","---","---"],
-            ["---","---","---","---","---","---","---","---"],
-            ["---","---","---","---","---","---","---","---"],
-            ["---","---","---","---","---","---","---","---"],
-            [Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p")],
-            [Piece("b_r"),Piece("b_n"),Piece("b_b"),Piece("b_q"),Piece("b_k"),Piece("b_b"),Piece("b_n"),Piece("b_r")]
-            ])
+    def create_board(self):
+        board = np.array([
+        [Piece("b_r"),Piece("b_n"),Piece("b_b"),Piece("b_q"),Piece("b_k"),Piece("b_b"),Piece("b_n"),Piece("b_r")],
+        [Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p"),Piece("b_p")],
+        ["---","---","---","---","---","---","---","---"],
+        ["---","---","---","---","---","---","---","---"],
+        ["---","---","---","---","---","---","---","---"],
+        ["---","---","---","---","---","---","---","---"],
+        [Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p"),Piece("w_p")],
+        [Piece("w_r"),Piece("w_n"),Piece("w_b"),Piece("w_q"),Piece("w_k"),Piece("w_b"),Piece("w_n"),Piece("w_r")]
+        ])
         return board
 
+    def own_history(self):
+        """
+        Copy the history before changing it if it's shared with a clone.
+        """
+        if self.history_shared:
+            self.history = list(self.history)
+            self.history_shared = False
+
+    def clone(self):
+        """
+        Cheap copy of the state: the board is copied (the pieces themselves are shared) and the move history is
+        shared until either state plays or undoes a move.
+        """
+        state = State.__new__(State)
+        state.board = self.board.copy()
+        state.size = self.size
+        state.moving_player = self.moving_player
+        state.moves = self.moves
+        state.history = self.history
+        state.history_shared = self.history_shared = True
+        state.kings = list(self.kings)
+        state.pins = []
+        state.checks = []
+        state.checked = list(self.checked)
+        state.enpassant_square = self.enpassant_square
+        state.key = self.key
+        state.verbose = self.verbose
+        state.captures_only = False
+        return state
+
+    def to_bytes(self,key=False):
+        """
+        Pack the position into a SNAPSHOT.size bytes snapshot, without the move history.
+        key: also store the position key, so receivers don't need to hash the position again.
+        """
+        buffer = bytearray(SNAPSHOT.size)
+        self.to_buffer(buffer,0,key)
+        return bytes(buffer)
+
+    def to_buffer(self,buffer,offset=0,key=False):
+        """
+        Write the snapshot straight into a writable buffer (bytearray, memoryview, shared memory...) at offset.
+        """
+        board = bytes([bytes_by_name[str(piece)] for piece in self.board.flat])
+        if self.enpassant_square == ():
+            enpassant = -1
+        else:
+            enpassant = self.enpassant_square[0]*8 + self.enpassant_square[1]
+        position_key = 0
+        if key:
+            position_key = self.key or get_position_key(board + bytes([self.moving_player, enpassant & 0xff]))
+        SNAPSHOT.pack_into(buffer,offset,board,self.moving_player,enpassant,0,self.moves,position_key)
+
+    @staticmethod
+    def from_bytes(data,offset=0):
+        """
+        Build a State (with no history) from a snapshot in any buffer, read in place. A stored key is kept for get_key.
+        """
+        board, player, enpassant, castling, moves, key = SNAPSHOT.unpack_from(data,offset)
+
+        state = State.__new__(State)
+        state.board = np.empty((8,8), dtype=object)
+        state.board.reshape(64)[:] = [pieces_by_byte[code] for code in board]
+        state.size = 8
+        state.moving_player = player
+        state.moves = moves
+        state.history = []
+        state.history_shared = False
+        state.kings = [(7,4),(0,4)]
+        for tile in range(64):
+            if board[tile] == KING:
+                state.kings[0] = (tile // 8, tile % 8)
+            elif board[tile] == -KING & 0xff:
+                state.kings[1] = (tile // 8, tile % 8)
+        state.pins = []
+        state.checks = []
+        state.checked = [False,False]
+        state.enpassant_square = () if enpassant < 0 else (enpassant // 8, enpassant % 8)
+        state.key = key
+        state.verbose = True
+        state.captures_only = False
+        return state
+
+    def get_key(self):
+        """
+        64-bit key of the position, used by the analysis cache. Hashed unless it came with the snapshot.
+        """
+        if self.key != 0:
+            return self.key
+        return get_position_key(self.to_bytes())
+
     def move_piece(self,move):
         #print(move.enpassant)
         self.board[move.src_row,move.src_col] = "---"
@@ -213,7 +339,8 @@ class State:
             self.board[move.dst_row,move.dst_col] = Piece(move.piece.color + '_q')
 
         if move.enpassant:
-            print("enpassant capture")
+            if self.verbose:
+                print("enpassant capture")
             self.board[move.src_row,move.dst_col] = '---'
 
         if move.piece.type == 'p' and abs(move.src_row - move.dst_row) == 2:
@@ -221,7 +348,9 @@ class State:
         else:
             self.enpassant_square = ()
 
+        self.own_history()
         self.history.append(move) # Added move to log
+        self.key = 0
 
 
     def undo(self):
@@ -229,11 +358,13 @@ class State:
         Undo last move.
         """
         if len(self.history) > 0:
+            self.own_history()
             move = self.history.pop()
             self.board[move.src_row,move.src_col] = move.piece
             self.board[move.dst_row,move.dst_col] = move.capture
             self.moves -= 1
             self.moving_player = self.get_moving_player()
+            self.key = 0
 
             if move.piece.type == 'k':
                 self.kings[(self.moving_player) % len(self.kings)] = (move.src_row,move.src_col)
@@ -285,7 +416,7 @@ class State:
 
                 # Remove unsafe moves
                 for i in range(len(moves)-1,-1,-1):
-                    if moves[i].piece.type != 'k':
+                    if moves[i].piece.type != 'k' and not moves[i].enpassant: # En passant legality is already fully checked
                         if not (moves[i].dst_row, moves[i].dst_col) in valid_tiles:
                             moves.remove(moves[i])
             else:
@@ -296,13 +427,42 @@ class State:
         self.enpassant_square = current_enpassant_square
         return moves
 
+    def get_capture_moves(self):
+        """
+        Get all valid captures and promotions for the current player (the moves searched by quiescence), or every
+        valid move when in check since all evasions are needed then. Quiet moves are skipped while generating, not
+        filtered out afterwards.
+        """
+        self.captures_only = True
+        try:
+            return self.get_valid_moves()
+        finally:
+            self.captures_only = False
+
+    def skip_quiet_moves(self):
+        """
+        Whether quiet moves are left out while generating: only captures are wanted and the king isn't in check.
+        """
+        return self.captures_only and not self.checked[self.moving_player]
+
+    def add_move(self,moves,src,dst):
+        """
+        Add a move to the list, unless only captures and promotions are wanted and it's a quiet move.
+        """
+        if self.skip_quiet_moves() and self.board[dst] == '---':
+            piece = self.board[src]
+            if piece.type != 'p' or dst[0] not in (0,self.size-1):
+                return
+        moves.append(Move(src,dst,self.board))
+
     def get_all_moves(self):
         """
         Get all legal moves for the current player.
         """
         moves = []
 
-        print("Getting moves.")
+        if self.verbose:
+            print("Getting moves.")
 
         for row in range(len(self.board)):
             for col in range(len(self.board[row])):
@@ -337,59 +497,25 @@ class State:
                     self.pins.remove(self.pins[i])
                     break
 
-            if self.moving_player == 0: # White pawn
-                if self.board[row-1,col] == "---":  # White pawn can only move up
-                    if not piece_pinned or pin_direction == (-1,0):
-                        moves.append(Move((row,col),(row-1,col),self.board))
-                        if row == 6 and self.board[row-2,col] == "---":
-                            moves.append(Move((row,col),(row-2,col),self.board))
-                # White pawn capturing
-                if col-1 >= 0:
-                    if not piece_pinned or pin_direction == (-1,-1):
-                        tile = self.board[row-1,col-1]
-                        if tile != "---":
-                            if tile.color == 'b':
-                                moves.append(Move((row,col),(row-1,col-1),self.board))
-                        elif (row-1,col-1) == self.enpassant_square:
-                            new_move = Move((row,col),(row-1,col-1),self.board)
-                            new_move.set_enpassant()
-                            moves.append(new_move)
-                if col+1 <= self.size-1:
-                    if not piece_pinned or pin_direction == (-1,1):
-                        tile = self.board[row-1,col+1]
-                        if tile != "---":
-                            if tile.color == 'b':
-                                moves.append(Move((row,col),(row-1,col+1),self.board))
-                        elif (row-1,col+1) == self.enpassant_square:
-                            new_move = Move((row,col),(row-1,col+1),self.board)
-                            new_move.set_enpassant()
-                            moves.append(new_move)
+            forward = -1 if color == 'w' else 1 # White pawns move up the board, black pawns down
+            start_row = 6 if color == 'w' else 1
+            enemy = all_colors[(self.moving_player+1) % len(all_colors)]
 
-            elif self.moving_player == 1: # Black pawn
-                if self.board[row+1,col] == "---":
-                    if not piece_pinned or pin_direction == (1,0):
-                        moves.append(Move((row,col),(row+1,col),self.board))
-                        if row == 1 and self.board[row+2,col] == "---":
-                            moves.append(Move((row,col),(row+2,col),self.board))
-                # Black pawn capturing
-                if col-1 >= 0:
-                    if not piece_pinned or pin_direction == (1,-1):
-                        tile = self.board[row+1,col-1]
+            if self.board[row+forward,col] == "---":
+                if not piece_pinned or pin_direction == (forward,0) or pin_direction == (-forward,0):
+                    self.add_move(moves,(row,col),(row+forward,col))
+                    if row == start_row and self.board[row+2*forward,col] == "---":
+                        self.add_move(moves,(row,col),(row+2*forward,col))
+            # Pawn capturing
+            for side in (-1,1):
+                if 0 <= col+side <= self.size-1:
+                    if not piece_pinned or pin_direction == (forward,side) or pin_direction == (-forward,-side):
+                        tile = self.board[row+forward,col+side]
                         if tile != "---":
-                            if tile.color == 'w':
-                                moves.append(Move((row,col),(row+1,col-1),self.board))
-                        elif (row+1,col-1) == self.enpassant_square:
-                            new_move = Move((row,col),(row+1,col-1),self.board)
-                            new_move.set_enpassant()
-                            moves.append(new_move)
-                if col+1 <= self.size-1:
-                    if not piece_pinned or pin_direction == (1,1):
-                        tile = self.board[row+1,col+1]
-                        if tile != "---":
-                            if tile.color == 'w':
-                                moves.append(Move((row,col),(row+1,col+1),self.board))
-                        elif (row+1,col+1) == self.enpassant_square:
-                            new_move = Move((row,col),(row+1,col+1),self.board)
+                            if tile.color == enemy:
+                                self.add_move(moves,(row,col),(row+forward,col+side))
+                        elif (row+forward,col+side) == self.enpassant_square and self.is_enpassant_safe(row,col,col+side):
+                            new_move = Move((row,col),(row+forward,col+side),self.board)
                             new_move.set_enpassant()
                             moves.append(new_move)
 
@@ -415,9 +541,9 @@ class State:
                 if (new_row in range(self.size)) and (new_col in range(self.size)):
                     if not piece_pinned:
                         if self.board[new_row,new_col] == '---':
-                            moves.append(Move((row,col),(new_row,new_col),self.board))
+                            self.add_move(moves,(row,col),(new_row,new_col))
                         elif self.board[new_row,new_col].color == enemy:
-                            moves.append(Move((row,col),(new_row,new_col),self.board))
+                            self.add_move(moves,(row,col),(new_row,new_col))
 
         elif type == 'r': # Rooks
             enemy = all_colors[(self.moving_player+1) % len(all_colors)]
@@ -436,41 +562,41 @@ class State:
             directions = [(-1,0),(0,-1),(1,0),(0,1)]
 
             for new_col in range(col+1,self.size):
-                if not piece_pinned or pin_direction == (0,1):
+                if not piece_pinned or pin_direction == (0,1) or pin_direction == (0,-1):
                     if self.board[row,new_col] == '---':
-                        moves.append(Move((row,col),(row,new_col),self.board))
+                        self.add_move(moves,(row,col),(row,new_col))
                     elif self.board[row,new_col].color == enemy:
-                        moves.append(Move((row,col),(row,new_col),self.board))
+                        self.add_move(moves,(row,col),(row,new_col))
                         break
                     else:
                         break
 
             for new_col in range(col-1,-1,-1):
-                if not piece_pinned or pin_direction == (0,-1):
+                if not piece_pinned or pin_direction == (0,-1) or pin_direction == (0,1):
                     if self.board[row,new_col] == '---':
-                        moves.append(Move((row,col),(row,new_col),self.board))
+                        self.add_move(moves,(row,col),(row,new_col))
                     elif self.board[row,new_col].color == enemy:
-                        moves.append(Move((row,col),(row,new_col),self.board))
+                        self.add_move(moves,(row,col),(row,new_col))
                         break
                     else:
                         break
 
             for new_row in range(row+1,self.size):
-                if not piece_pinned or pin_direction == (1,0):
+                if not piece_pinned or pin_direction == (1,0) or pin_direction == (-1,0):
                     if self.board[new_row,col] == '---':
-                        moves.append(Move((row,col),(new_row,col),self.board))
+                        self.add_move(moves,(row,col),(new_row,col))
                     elif self.board[new_row,col].color == enemy:
-                        moves.append(Move((row,col),(new_row,col),self.board))
+                        self.add_move(moves,(row,col),(new_row,col))
                         break
                     else:
                         break
 
             for new_row in range(row-1,-1,-1):
-                if not piece_pinned or pin_direction == (-1,0):
+                if not piece_pinned or pin_direction == (-1,0) or pin_direction == (1,0):
                     if self.board[new_row,col] == '---':
-                        moves.append(Move((row,col),(new_row,col),self.board))
+                        self.add_move(moves,(row,col),(new_row,col))
                     elif self.board[new_row,col].color == enemy:
-                        moves.append(Move((row,col),(new_row,col),self.board))
+                        self.add_move(moves,(row,col),(new_row,col))
                         break
                     else:
                         break
@@ -483,7 +609,8 @@ class State:
                 if self.pins[i][0] == row and self.pins[i][1] == col:
                     piece_pinned = True
                     pin_direction = (self.pins[i][2],self.pins[i][3])
-                    self.pins.remove(self.pins[i])
+                    if self.board[row,col].type != 'q': # Queen's pin is still needed for its rook moves
+                        self.pins.remove(self.pins[i])
                     break
 
             enemy = all_colors[(self.moving_player+1) % len(all_colors)]
@@ -505,9 +632,9 @@ class State:
 
                     if not piece_pinned or pin_direction == direction or pin_direction == (-direction[0],-direction[1]):
                         if self.board[new_row,new_col] == '---':
-                            moves.append(Move((row,col),(new_row,new_col),self.board))
+                            self.add_move(moves,(row,col),(new_row,new_col))
                         elif self.board[new_row,new_col].color == enemy:
-                            moves.append(Move((row,col),(new_row,new_col),self.board))
+                            self.add_move(moves,(row,col),(new_row,new_col))
                             break
                         else:
                             break
@@ -527,13 +654,31 @@ class State:
 
                 if (0 <= new_row) and (new_row <= self.size-1) and (0 <= new_col) and (new_col <= self.size-1):
                     piece = self.board[new_row,new_col]
-                    if piece == '---' or piece.color == enemy:
+                    if (piece == '---' and not self.skip_quiet_moves()) or (piece != '---' and piece.color == enemy):
                         self.kings[self.moving_player] = (new_row,new_col)
                         checked, pins, checks = self.get_pins_and_checks()
                         if not checked:
-                            moves.append(Move((row,col),(new_row,new_col),self.board))
+                            self.add_move(moves,(row,col),(new_row,new_col))
                         self.kings[self.moving_player] = (row,col)
 
+    def is_enpassant_safe(self,row,col,dst_col):
+        """
+        Check that an en passant capture doesn't leave the king in check. Both pawns leave the same rank, which the
+        pins can't see, and the captured pawn may be the one giving check, so play the capture out and look for checks.
+        """
+        dst_row = self.enpassant_square[0]
+        pawn = self.board[row,col]
+        captured = self.board[row,dst_col]
+
+        self.board[row,col] = '---'
+        self.board[row,dst_col] = '---'
+        self.board[dst_row,dst_col] = pawn
+        checked, pins, checks = self.get_pins_and_checks()
+        self.board[dst_row,dst_col] = '---'
+        self.board[row,dst_col] = captured
+        self.board[row,col] = pawn
+        return not checked
+
     def get_pins_and_checks(self):
         pins = []
         checks = []
@@ -543,8 +688,6 @@ class State:
 
         king_row, king_col = self.get_my_king()
 
-        directions = [(-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1)]
-
         for j in range(len(directions)):
             direction = directions[j]
             possible_pin = ()
@@ -566,10 +709,7 @@ class State:
                         elif piece.color == enemy:
                             # Checks for all directions from king + knight's L tiles from kings for possible checks/pins.
 
-                            if (0 <= j <= 3 and type == 'r') \
-                            or (4 <= j <= 7 and type == 'b') \
-                            or (i == 1 and type == 'p' and ((enemy == 'w' and 6 <= j <= 7) or (enemy == 'b' and 4 <= j <= 5))) \
-                            or (type == 'q') or (i == 1 and type == 'k'):
+                            if is_attacker(piece,j,i):
 
                                 if possible_pin == (): # No blocking ally -> Check
                                     checked = True
@@ -581,8 +721,6 @@ class State:
                             else:
                                 break
 
-        knight_moves = [(-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)]
-
         for move in knight_moves:
             end_row = king_row + move[0]
             end_col = king_col + move[1]
@@ -594,3 +732,89 @@ class State:
                         checked = True
                         checks.append((end_row,end_col,move[0],move[1]))
         return checked, pins, checks
+
+    def get_attackers(self,row,col,color):
+        """
+        Get all pieces of a given color directly attacking a tile, as (row,col) coordinates.
+        Uses the same direction scan as get_pins_and_checks, so pieces behind the first blocker (x-rays) are not included.
+        """
+        attackers = []
+
+        for j in range(len(directions)):
+            direction = directions[j]
+
+            for i in range(1,8):
+                end_row = row + direction[0]*i
+                end_col = col + direction[1]*i
+
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+
+                piece = self.board[end_row,end_col]
+                if piece != '---':
+                    if piece.color == color and is_attacker(piece,j,i):
+                        attackers.append((end_row,end_col))
+                    break
+
+        for move in knight_moves:
+            end_row = row + move[0]
+            end_col = col + move[1]
+
+            if 0 <= end_row < 8 and 0 <= end_col < 8:
+                piece = self.board[end_row,end_col]
+                if piece != '---':
+                    if piece.color == color and piece.type == 'n':
+                        attackers.append((end_row,end_col))
+        return attackers
+
+    def see(self,move):
+        """
+        Static exchange evaluation: material won (in centipawns) by the moving side once the whole
+        capture sequence on the move's destination tile is played out, each side always recapturing
+        with its least valuable attacker and free to stop when recapturing would lose material.
+        Pins are ignored. The board is left unchanged.
+        """
+        row, col = move.dst_row, move.dst_col
+        changed = [] # Tiles modified during the exchange, restored at the end
+
+        def set_tile(tile_row,tile_col,piece):
+            changed.append((tile_row,tile_col,self.board[tile_row,tile_col]))
+            self.board[tile_row,tile_col] = piece
+
+        gain = [0]
+        if move.capture != '---':
+            gain[0] = pieces_values[move.capture.type]
+
+        piece = move.piece
+        if move.promotion:
+            piece = Piece(piece.color + '_q')
+            gain[0] += pieces_values['q'] - pieces_values['p']
+
+        set_tile(move.src_row,move.src_col,'---')
+        if move.enpassant:
+            set_tile(move.src_row,move.dst_col,'---')
+        set_tile(row,col,piece)
+
+        color = piece.color
+        try:
+            while True:
+                color = all_colors[(all_colors.index(color)+1) % len(all_colors)]
+                attackers = self.get_attackers(row,col,color)
+                if len(attackers) == 0:
+                    break
+
+                # Recapture with the least valuable attacker; removing it uncovers any x-ray attacker behind
+                src_row, src_col = min(attackers, key=lambda tile: pieces_values[self.board[tile].type])
+                attacker = self.board[src_row,src_col]
+                gain.append(pieces_values[self.board[row,col].type] - gain[-1])
+
+                set_tile(src_row,src_col,'---')
+                set_tile(row,col,attacker)
+        finally:
+            for tile_row, tile_col, tile in reversed(changed):
+                self.board[tile_row,tile_col] = tile
+
+        # Each side may decline to recapture, resolve the sequence from the end
+        for d in range(len(gain)-1,0,-1):
+            gain[d-1] = -max(-gain[d-1],gain[d])
+        return gain[0]
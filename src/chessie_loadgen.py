@@ -0,0 +1,133 @@
+"""
+LOAD GENERATOR FOR THE CHESSIE SERVER.
+
+Opens many connections, each playing several games of random legal moves (query, then move), with an occasional
+undo and engine move, and reports request throughput, round-trip latencies and the server's own stats.
+
+Usage: python chessie_loadgen.py [--host 127.0.0.1] [--port 8765] [--unix PATH]
+                                 [--connections 50] [--games 20] [--plies 40] [--think-every 0] [--depth 1]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+class Client:
+    def __init__(self,reader,writer):
+        """
+        Requests are pipelined on one connection, replies are matched back by id.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting = {}
+        self.latencies = {} # op -> round-trip latencies in seconds
+        self.listener = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            future = self.waiting.pop(reply["id"],None)
+            if future is not None:
+                future.set_result(reply)
+
+    async def request(self,op,**fields):
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+
+        fields.update({"id": self.next_id, "op": op})
+        start = time.perf_counter()
+        self.writer.write((json.dumps(fields) + "\n").encode())
+        await self.writer.drain()
+        reply = await future
+        self.latencies.setdefault(op,[]).append(time.perf_counter() - start)
+        return reply
+
+    async def close(self):
+        self.writer.close()
+        self.listener.cancel()
+
+
+async def play_game(client,plies,think_every,depth):
+    game = (await client.request("new"))["game"]
+    for ply in range(plies):
+        if think_every > 0 and ply % think_every == think_every - 1:
+            reply = await client.request("think",game=game,depth=depth,play=True)
+            if reply.get("move") is None:
+                break
+            continue
+
+        moves = (await client.request("query",game=game))["moves"]
+        if len(moves) == 0:
+            break
+        await client.request("move",game=game,move=random.choice(moves))
+        if random.random() < 0.05:
+            await client.request("undo",game=game)
+    return game
+
+
+async def run_connection(args):
+    if args.unix is not None:
+        reader, writer = await asyncio.open_unix_connection(args.unix)
+    else:
+        reader, writer = await asyncio.open_connection(args.host,args.port)
+    client = Client(reader,writer)
+
+    # Games stay open until every connection is done so the server's memory stats cover all of them
+    games = await asyncio.gather(*[play_game(client,args.plies,args.think_every,args.depth) for _ in range(args.games)])
+    return client, games
+
+
+async def run(args):
+    start = time.perf_counter()
+    results = await asyncio.gather(*[run_connection(args) for _ in range(args.connections)])
+    elapsed = time.perf_counter() - start
+
+    latencies = {}
+    for client, _ in results:
+        for op, samples in client.latencies.items():
+            latencies.setdefault(op,[]).extend(samples)
+
+    total = sum(len(samples) for samples in latencies.values())
+    print("{} connections x {} games, {} requests in {:.2f}s ({:.0f} requests/s)".format(
+        args.connections, args.games, total, elapsed, total/elapsed))
+    for op, samples in sorted(latencies.items()):
+        samples.sort()
+        print("  {:6} n={:7} mean={:7.2f}ms p50={:7.2f}ms p99={:7.2f}ms".format(
+            op, len(samples), 1000*sum(samples)/len(samples), 1000*samples[len(samples)//2],
+            1000*samples[min(len(samples)-1,len(samples)*99//100)]))
+
+    client = results[0][0]
+    stats = await client.request("stats")
+    print("Server: {} games, {:.0f} bytes per game".format(stats["games"],stats["bytes_per_game"]))
+    for op, stat in sorted(stats["latency"].items()):
+        print("  {:6} n={:7} mean={:7.2f}ms p50={:7.2f}ms p99={:7.2f}ms".format(
+            op, stat["count"], stat["mean_ms"], stat["p50_ms"], stat["p99_ms"]))
+
+    for client, games in results:
+        for game in games:
+            await client.request("close",game=game)
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a Chessie server with many concurrent random games.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="Unix socket path, used instead of TCP.")
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--games", type=int, default=20, help="Concurrent games per connection.")
+    parser.add_argument("--plies", type=int, default=40, help="Moves played per game.")
+    parser.add_argument("--think-every", type=int, default=0, help="Let the engine play every N plies (0: never).")
+    parser.add_argument("--depth", type=int, default=1, help="Engine search depth.")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
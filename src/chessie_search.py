@@ -0,0 +1,175 @@
+"""
+SEARCH FOR CHESSIE: FIXED-DEPTH ALPHA-BETA WITH A QUIESCENCE SEARCH AT THE LEAVES.
+"""
+from chessie_engine import *
+
+MATE_SCORE = 100000
+
+
+class Search:
+    def __init__(self,state,cache=None):
+        """
+        Using Search class to keep node counts and the searched state together.
+        All scores are in centipawns from the point of view of the player to move.
+        cache: optional AnalysisCache, looked up before searching and given the result afterwards.
+        """
+        self.state = state
+        self.cache = cache
+        self.nodes = 0
+        self.root_ply = len(state.history) # Mate scores count plies from here, not from the start of the game
+
+    def evaluate(self):
+        """
+        Material balance of the current position.
+        """
+        score = 0
+        for row in range(self.state.size):
+            for col in range(self.state.size):
+                piece = self.state.board[row,col]
+                if piece != '---':
+                    if piece.color == all_colors[self.state.moving_player]:
+                        score += pieces_values[piece.type]
+                    else:
+                        score -= pieces_values[piece.type]
+        return score
+
+    def get_ply(self):
+        """
+        Plies played since the search root.
+        """
+        return len(self.state.history) - self.root_ply
+
+    def make_move(self,move):
+        """
+        Play a move, returning the en passant tile to restore on undo_move (State.undo doesn't keep it).
+        """
+        enpassant_square = self.state.enpassant_square
+        self.state.move_piece(move)
+        return enpassant_square
+
+    def undo_move(self,enpassant_square):
+        self.state.undo()
+        self.state.enpassant_square = enpassant_square
+
+    def quiescence(self,alpha,beta):
+        """
+        Search captures and promotions only until the position is quiet.
+        Captures losing material by static exchange evaluation are pruned, the others are searched best first.
+        When in check every evasion is searched, since standing pat isn't an option.
+        """
+        self.nodes += 1
+
+        moves = self.state.get_capture_moves() # Every evasion when in check, quiet ones included
+        if self.state.checked[self.state.moving_player]:
+            if len(moves) == 0:
+                return -MATE_SCORE + self.get_ply()
+            scored_moves = [(0,move) for move in moves]
+        else:
+            stand_pat = self.evaluate()
+            if stand_pat >= beta:
+                return stand_pat
+            alpha = max(alpha,stand_pat)
+
+            scored_moves = []
+            for move in moves:
+                see = self.state.see(move)
+                if see >= 0:
+                    scored_moves.append((see,move))
+            scored_moves.sort(key=lambda scored_move: scored_move[0], reverse=True)
+
+        for _, move in scored_moves:
+            enpassant_square = self.make_move(move)
+            score = -self.quiescence(-beta,-alpha)
+            self.undo_move(enpassant_square)
+
+            if score >= beta:
+                return score
+            alpha = max(alpha,score)
+        return alpha
+
+    def negamax(self,depth,alpha,beta):
+        """
+        Fixed-depth alpha-beta search, resolving the leaves with quiescence.
+        """
+        if depth == 0:
+            return self.quiescence(alpha,beta)
+
+        self.nodes += 1
+
+        moves = self.state.get_valid_moves()
+        if len(moves) == 0:
+            if self.state.checked[self.state.moving_player]:
+                return -MATE_SCORE + self.get_ply() # Checkmate, prefer the quickest one
+            return 0 # Stalemate
+
+        # Winning captures first, then the rest
+        moves.sort(key=lambda move: self.state.see(move) if move.capture != '---' or move.promotion else -1, reverse=True)
+
+        for move in moves:
+            enpassant_square = self.make_move(move)
+            score = -self.negamax(depth-1,-beta,-alpha)
+            self.undo_move(enpassant_square)
+
+            if score >= beta:
+                return score
+            alpha = max(alpha,score)
+        return alpha
+
+    def find_best_move(self,depth):
+        """
+        Return (best move, score) for the player to move, searching depth plies before quiescence.
+        """
+        verbose = self.state.verbose
+        self.state.verbose = False
+        self.root_ply = len(self.state.history)
+        try:
+            key = None
+            if self.cache is not None:
+                key = self.state.get_key()
+                cached = self.get_cached_move(key,depth)
+                if cached is not None:
+                    return cached
+
+            best_move = None
+            alpha = -MATE_SCORE-1
+            beta = MATE_SCORE+1
+
+            for move in self.state.get_valid_moves():
+                enpassant_square = self.make_move(move)
+                score = -self.negamax(depth-1,-beta,-alpha) if depth > 0 else -self.quiescence(-beta,-alpha)
+                self.undo_move(enpassant_square)
+
+                if best_move is None or score > alpha:
+                    best_move = move
+                    alpha = score
+
+            if best_move is None: # Mate or stalemate
+                alpha = -MATE_SCORE + self.get_ply() if self.state.checked[self.state.moving_player] else 0
+
+            if key is not None:
+                if best_move is None:
+                    self.cache.put(key,-1,-1,alpha,depth,self.nodes)
+                else:
+                    self.cache.put(key,best_move.src_row*8 + best_move.src_col,best_move.dst_row*8 + best_move.dst_col,
+                                   alpha,depth,self.nodes)
+            return best_move, alpha
+        finally:
+            self.state.verbose = verbose
+
+    def get_cached_move(self,key,depth):
+        """
+        Return (move, score) from the cache when a search at least as deep was stored for this position, else None.
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+
+        src, dst, score, cached_depth, nodes = entry
+        if cached_depth < depth:
+            return None
+        if src < 0:
+            return None, score
+        for move in self.state.get_valid_moves():
+            if (move.src_row*8 + move.src_col, move.dst_row*8 + move.dst_col) == (src,dst):
+                return move, score
+        return None # Stale entry (hash collision), search again
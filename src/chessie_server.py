@@ -0,0 +1,389 @@
+"""
+ASYNCIO SERVER HOSTING MANY CHESSIE GAMES FROM ONE PROCESS.
+
+Clients talk line-delimited JSON over TCP or a Unix socket, one request object per line, one reply per request:
+    {"id": 1, "op": "new"}                                  -> {"id": 1, "ok": true, "game": 0}
+    {"id": 2, "op": "move", "game": 0, "move": "e2e4"}      -> {"id": 2, "ok": true, "game": 0}
+    {"id": 3, "op": "undo", "game": 0}
+    {"id": 4, "op": "query", "game": 0}                     -> board, player, en passant, legal moves, history
+    {"id": 5, "op": "think", "game": 0, "depth": 2, "play": true}  -> best move, score, nodes (depth 0 to 3)
+    {"id": 6, "op": "close", "game": 0}
+    {"id": 7, "op": "stats"}                                -> games, bytes per game, latency per op
+Errors come back as {"id": ..., "ok": false, "error": "..."}.
+
+Games are kept as packed 66-byte positions (board, player, en passant), one per ply so undo is a pop.
+Legal moves of all pending move/query requests are generated together, with chessie_batch on a thread when there
+are enough of them, and engine thinking runs in a process pool so the event loop never waits on a search.
+
+With --cache, think results are looked up in and written back to a persistent AnalysisCache (chessie_cache), which
+other servers and analysis jobs can share.
+
+Usage: python chessie_server.py [--host 127.0.0.1] [--port 8765] [--unix PATH] [--workers N] [--cache PATH]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from chessie_batch import *
+from chessie_cache import AnalysisCache
+from chessie_search import Search
+
+BATCH_SIZE = 256 # Most positions sent to get_valid_moves_batch at once
+SMALL_BATCH = 16 # Fewer positions than this are faster one by one than with get_valid_moves_batch
+LATENCY_SAMPLES = 10000 # Latencies kept per op for percentiles
+MAX_DEPTH = 3 # Deepest think allowed, deeper searches would hold a worker for minutes
+
+
+def get_tile_notation(tile):
+    return Move.cols_to_files[tile % 8] + Move.rows_to_ranks[tile // 8]
+
+
+def get_tile(notation):
+    return Move.ranks_to_rows[notation[1]]*8 + Move.files_to_cols[notation[0]]
+
+
+def think(record,depth):
+    """
+    Search a packed position, run in the worker processes. Returns (src,dst,score,nodes), src is -1 with no moves.
+    """
+    state = arrays_to_state(*unpack_position(record))
+    search = Search(state)
+    move, score = search.find_best_move(depth)
+    if move is None:
+        return -1, -1, score, search.nodes
+    return move.src_row*8 + move.src_col, move.dst_row*8 + move.dst_col, score, search.nodes
+
+
+def get_legal_moves(record):
+    """
+    Sorted (src,dst) legal moves of a packed position, from the per-position generator.
+    """
+    state = arrays_to_state(*unpack_position(record))
+    return sorted((move.src_row*8 + move.src_col, move.dst_row*8 + move.dst_col) for move in state.get_valid_moves())
+
+
+def get_legal_moves_batch(records):
+    """
+    Sorted (src,dst) legal moves of many packed positions, from get_valid_moves_batch.
+    """
+    positions = [unpack_position(record) for record in records]
+    boards = np.stack([position[0] for position in positions])
+    players = np.array([position[1] for position in positions], dtype=np.int8)
+    enpassant = np.array([position[2] for position in positions], dtype=np.int8)
+
+    legal_moves = [[] for _ in records]
+    for position, src, dst in get_valid_moves_batch(boards,players,enpassant).tolist():
+        legal_moves[position].append((src,dst))
+    return legal_moves
+
+
+class Game:
+    """
+    One game: its positions packed back to back, and the moves between them as (src,dst) byte pairs.
+    """
+    __slots__ = ["positions", "moves"]
+
+    def __init__(self,record):
+        self.positions = bytearray(record)
+        self.moves = bytearray()
+
+    def get_position(self):
+        return bytes(self.positions[-RECORD_SIZE:])
+
+    def push(self,record,src,dst):
+        self.positions += record
+        self.moves += bytes([src,dst])
+
+    def pop(self):
+        if len(self.moves) == 0:
+            return False
+        del self.positions[-RECORD_SIZE:]
+        del self.moves[-2:]
+        return True
+
+    def get_size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.positions) + sys.getsizeof(self.moves)
+
+
+class LegalMovesBatcher:
+    """
+    Collect the positions whose legal moves are requested while the event loop is busy and answer them together.
+    Small batches are cheaper position by position (State.get_valid_moves) and run on the loop, larger ones go to
+    get_valid_moves_batch in the executor. One chunk of BATCH_SIZE positions is handled per turn of the loop.
+    """
+    def __init__(self,executor):
+        self.executor = executor
+        self.pending = []
+        self.scheduled = False
+
+    def get(self,record):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((record,future))
+        if not self.scheduled:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+        return future
+
+    def flush(self):
+        pending = self.pending[:BATCH_SIZE]
+        self.pending = self.pending[BATCH_SIZE:]
+        if len(self.pending) > 0:
+            asyncio.get_running_loop().call_soon(self.flush) # Let other callbacks run before the next chunk
+        else:
+            self.scheduled = False
+
+        records = [record for record, _ in pending]
+        if len(pending) < SMALL_BATCH:
+            try:
+                self.resolve(pending,[get_legal_moves(record) for record in records])
+            except Exception as e:
+                self.fail(pending,e)
+        else:
+            batch = asyncio.get_running_loop().run_in_executor(self.executor,get_legal_moves_batch,records)
+            batch.add_done_callback(lambda batch: self.resolve_batch(pending,batch))
+
+    def resolve(self,pending,legal_moves):
+        for (_, future), position_moves in zip(pending,legal_moves):
+            if not future.done():
+                future.set_result(position_moves)
+
+    def resolve_batch(self,pending,batch):
+        if batch.cancelled(): # Server shutting down
+            for _, future in pending:
+                future.cancel()
+        elif batch.exception() is not None:
+            self.fail(pending,batch.exception())
+        else:
+            self.resolve(pending,batch.result())
+
+    def fail(self,pending,exception):
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(exception)
+
+
+class Server:
+    def __init__(self,workers=None,cache=None):
+        self.games = {}
+        self.next_game = 0
+        self.start_record = pack_position(*state_to_arrays(State()))
+        # Large legal moves batches run on their own thread, NumPy releases the GIL for much of the work
+        self.batch_thread = ThreadPoolExecutor(max_workers=1)
+        self.batcher = LegalMovesBatcher(self.batch_thread)
+        # Workers are started on demand: forking them from the server would hand them its open client sockets,
+        # which then never close. Start them from a clean forkserver process instead where there is one.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self.pool = ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context("forkserver"))
+        else:
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+        # The cache does disk I/O (and waits on other processes' locks), so it only runs on its own thread
+        self.cache = AnalysisCache(cache) if cache is not None else None
+        self.cache_thread = ThreadPoolExecutor(max_workers=1) if cache is not None else None
+        self.latencies = {} # op -> recent latencies in seconds
+        self.requests = {} # op -> number of requests served
+
+    def get_game(self,request):
+        game = self.games.get(request.get("game"))
+        if game is None:
+            raise ValueError("Unknown game.")
+        return game
+
+    async def op_new(self,request):
+        game_id = self.next_game
+        self.next_game += 1
+        self.games[game_id] = Game(self.start_record)
+        return {"game": game_id}
+
+    async def op_move(self,request):
+        game = self.get_game(request)
+        notation = str(request.get("move",""))
+        if len(notation) != 4 or notation[0] not in Move.files_to_cols or notation[2] not in Move.files_to_cols \
+                or notation[1] not in Move.ranks_to_rows or notation[3] not in Move.ranks_to_rows:
+            raise ValueError("Invalid move notation.")
+        src, dst = get_tile(notation[:2]), get_tile(notation[2:])
+
+        record = game.get_position()
+        if (src,dst) not in await self.batcher.get(record):
+            raise ValueError("Illegal move.")
+        if game.get_position() != record:
+            raise ValueError("Position changed.")
+        game.push(pack_position(*play_move(*unpack_position(record),src,dst)),src,dst)
+        return {"game": request["game"]}
+
+    async def op_undo(self,request):
+        if not self.get_game(request).pop():
+            raise ValueError("Nothing to undo.")
+        return {"game": request["game"]}
+
+    async def op_query(self,request):
+        game = self.get_game(request)
+        record = game.get_position()
+        board, player, enpassant = unpack_position(record)
+        legal_moves = await self.batcher.get(record)
+
+        letters = {code: name for name, code in pieces_codes.items()}
+        tiles = "".join('.' if code == EMPTY else (letters[abs(code)].upper() if code > 0 else letters[abs(code)])
+                        for code in board.tolist())
+        return {"game": request["game"],
+                "board": tiles,
+                "player": player,
+                "enpassant": get_tile_notation(enpassant) if enpassant >= 0 else None,
+                "moves": [get_tile_notation(src) + get_tile_notation(dst) for src, dst in legal_moves],
+                "history": [get_tile_notation(game.moves[i]) + get_tile_notation(game.moves[i+1])
+                            for i in range(0,len(game.moves),2)]}
+
+    async def op_think(self,request):
+        game = self.get_game(request)
+        depth = request.get("depth",2)
+        if not isinstance(depth,int) or isinstance(depth,bool) or not 0 <= depth <= MAX_DEPTH:
+            raise ValueError("Depth must be an integer from 0 to {}.".format(MAX_DEPTH))
+        record = game.get_position()
+
+        loop = asyncio.get_running_loop()
+        key = get_position_key(record)
+        entry = None
+        if self.cache is not None:
+            entry = await loop.run_in_executor(self.cache_thread,self.cache.get,key)
+        if entry is not None and entry[3] < depth:
+            entry = None
+        if entry is not None:
+            # The cache is shared with other processes: search again unless the cached move is legal here (a stale
+            # entry or a key collision isn't), like Search.get_cached_move
+            legal_moves = await self.batcher.get(record)
+            if (entry[0] < 0 and len(legal_moves) > 0) or (entry[0] >= 0 and (entry[0],entry[1]) not in legal_moves):
+                entry = None
+        if entry is not None:
+            src, dst, score, _, nodes = entry
+        else:
+            src, dst, score, nodes = await loop.run_in_executor(self.pool,think,record,depth)
+            if self.cache is not None:
+                await loop.run_in_executor(self.cache_thread,self.cache.put,key,src,dst,score,depth,nodes)
+
+        reply = {"game": request["game"], "move": None, "score": score, "nodes": nodes}
+        if src >= 0:
+            reply["move"] = get_tile_notation(src) + get_tile_notation(dst)
+            if request.get("play"):
+                if game.get_position() != record:
+                    raise ValueError("Position changed.")
+                game.push(pack_position(*play_move(*unpack_position(record),src,dst)),src,dst)
+        return reply
+
+    async def op_close(self,request):
+        self.get_game(request)
+        del self.games[request["game"]]
+        return {}
+
+    async def op_stats(self,request):
+        sizes = [game.get_size() for game in self.games.values()]
+        latencies = {}
+        for op, samples in self.latencies.items():
+            ordered = sorted(samples)
+            latencies[op] = {"count": self.requests[op],
+                             "mean_ms": 1000*sum(ordered)/len(ordered),
+                             "p50_ms": 1000*ordered[len(ordered)//2],
+                             "p99_ms": 1000*ordered[min(len(ordered)-1,len(ordered)*99//100)]}
+        return {"games": len(sizes),
+                "bytes_per_game": sum(sizes)/len(sizes) if sizes else 0,
+                "latency": latencies}
+
+    async def handle_request(self,line):
+        start = time.perf_counter()
+        request = {}
+        op = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request,dict):
+                request = {}
+                raise ValueError("Request must be a JSON object.")
+            op = request.get("op")
+            if not isinstance(op,str) or not hasattr(self,"op_{}".format(op)):
+                op = None
+                raise ValueError("Unknown op.")
+            reply = {"id": request.get("id"), "ok": True}
+            reply.update(await getattr(self,"op_{}".format(op))(request))
+        except (ValueError,KeyError,TypeError) as e:
+            reply = {"id": request.get("id"), "ok": False, "error": str(e)}
+        except Exception as e: # Anything else (engine errors, broken worker pool...) still gets a reply
+            reply = {"id": request.get("id"), "ok": False, "error": "{}: {}".format(type(e).__name__,e)}
+
+        if op is not None:
+            self.requests[op] = self.requests.get(op,0) + 1
+            self.latencies.setdefault(op,deque(maxlen=LATENCY_SAMPLES)).append(time.perf_counter() - start)
+        return reply
+
+    async def handle_client(self,reader,writer):
+        """
+        Requests from one connection are handled concurrently, replies are written as they complete (match by id).
+        """
+        tasks = set()
+
+        async def reply(line):
+            writer.write((json.dumps(await self.handle_request(line)) + "\n").encode())
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(reply(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                await writer.drain()
+            if tasks:
+                await asyncio.gather(*tasks)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self,host="127.0.0.1",port=8765,unix=None):
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle_client,path=unix)
+            print("Chessie server listening on {}".format(unix))
+        else:
+            server = await asyncio.start_server(self.handle_client,host,port)
+            print("Chessie server listening on {}:{}".format(host,port))
+
+        # Stop on SIGTERM like on Ctrl+C, so the cache gets flushed
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,asyncio.current_task().cancel)
+        except NotImplementedError: # Windows
+            pass
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown()
+            self.batch_thread.shutdown()
+            if self.cache is not None:
+                self.cache_thread.submit(self.cache.close).result()
+                self.cache_thread.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many Chessie games over line-delimited JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="Unix socket path, used instead of TCP.")
+    parser.add_argument("--workers", type=int, default=None, help="Engine processes (default: one per CPU).")
+    parser.add_argument("--cache", default=None, help="Analysis cache file shared with other processes.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(Server(args.workers,args.cache).serve(args.host,args.port,args.unix))
+    except (KeyboardInterrupt,asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()